@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+
+import sys
+import os
+import unittest
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from xapp.os import ProxyBypassMatcher
+
+
+class ProxyBypassMatcherTest(unittest.TestCase):
+
+    def test_domain_forms_match_domain_and_subdomains(self):
+        for entry in ("example.com", ".example.com", "*.example.com"):
+            matcher = ProxyBypassMatcher([entry])
+            self.assertTrue(matcher.should_bypass("example.com"), entry)
+            self.assertTrue(matcher.should_bypass("www.example.com"), entry)
+            self.assertTrue(matcher.should_bypass("a.b.example.com"), entry)
+            self.assertFalse(matcher.should_bypass("notexample.com"), entry)
+            self.assertFalse(matcher.should_bypass("example.org"), entry)
+
+    def test_single_label_host(self):
+        matcher = ProxyBypassMatcher(["localhost"])
+        self.assertTrue(matcher.should_bypass("localhost"))
+        self.assertTrue(matcher.should_bypass("LOCALHOST."))
+        self.assertFalse(matcher.should_bypass("localhost.example.com"))
+
+    def test_port(self):
+        matcher = ProxyBypassMatcher(["intranet:8080"])
+        self.assertTrue(matcher.should_bypass("intranet", 8080))
+        self.assertTrue(matcher.should_bypass("www.intranet", 8080))
+        self.assertFalse(matcher.should_bypass("intranet", 80))
+        self.assertFalse(matcher.should_bypass("intranet"))
+
+    def test_networks(self):
+        matcher = ProxyBypassMatcher(["127.0.0.0/8", "10.1.2.3", "::1", "fd00::/8"])
+        self.assertTrue(matcher.should_bypass("127.0.0.5"))
+        self.assertTrue(matcher.should_bypass("10.1.2.3"))
+        self.assertFalse(matcher.should_bypass("10.1.2.4"))
+        self.assertTrue(matcher.should_bypass("[::1]"))
+        self.assertTrue(matcher.should_bypass("fd12::1"))
+        self.assertFalse(matcher.should_bypass("2001:db8::1"))
+
+    def test_other_wildcards(self):
+        matcher = ProxyBypassMatcher(["192.168.*", "build-*.example.com"])
+        self.assertTrue(matcher.should_bypass("192.168.1.1"))
+        self.assertTrue(matcher.should_bypass("build-42.example.com"))
+        self.assertFalse(matcher.should_bypass("www.example.com"))
+
+    def test_match_all_and_empty(self):
+        self.assertTrue(ProxyBypassMatcher(["*"]).should_bypass("anything.org"))
+        self.assertFalse(ProxyBypassMatcher([]).should_bypass("anything.org"))
+        self.assertFalse(ProxyBypassMatcher(["", "  "]).should_bypass("anything.org"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,41 +1,98 @@
 #!/usr/bin/python3
 
+import contextlib
+
 from gi.repository import Gio, GLib
 from xapp.SettingsWidgets import *
+from xapp.threading import coalesce_idle
 
 CAN_BACKEND = ["Switch", "SpinButton", "Entry", "TextView", "FontButton", "Range", "ComboBox",
                "ColorChooser", "FileChooser", "IconChooser"]
 
+# Type and allowed values of a settings key, compiled once from its range
+class _KeyInfo(object):
+    def __init__(self, range):
+        self.range_type = range.get_child_value(0).get_string()
+        self.allowed = None
+        self.minimum = self.maximum = None
+        v = range.get_child_value(1)
+        if self.range_type == 'type':
+            # v is boxed empty array, type of its elements is the allowed value type
+            assert v.get_child_value(0).get_type_string().startswith('a')
+            self.type_str = v.get_child_value(0).get_type_string()[1:]
+        elif self.range_type == 'enum':
+            # v is an array with the allowed values
+            assert v.get_child_value(0).get_type_string().startswith('a')
+            self.type_str = v.get_child_value(0).get_child_value(0).get_type_string()
+            self.allowed = frozenset(v.get_child_value(0).unpack())
+        elif self.range_type == 'flags':
+            # v is an array with the allowed values
+            assert v.get_child_value(0).get_type_string().startswith('a')
+            self.type_str = v.get_child_value(0).get_type_string()
+            self.allowed = frozenset(v.get_child_value(0).unpack())
+        elif self.range_type == 'range':
+            # type_str is a tuple giving the range
+            assert v.get_child_value(0).get_type_string().startswith('(')
+            self.type_str = v.get_child_value(0).get_type_string()[1]
+            self.minimum, self.maximum = v.get_child_value(0).unpack()
+
+    def validate(self, value):
+        try:
+            # Whatever the range, the value must fit the key's type
+            GLib.Variant(self.type_str, value)
+        except (TypeError, ValueError, OverflowError):
+            return False
+
+        try:
+            if self.range_type == 'enum':
+                return value in self.allowed
+            elif self.range_type == 'flags':
+                return all(flag in self.allowed for flag in value)
+            elif self.range_type == 'range':
+                return self.minimum <= value <= self.maximum
+        except TypeError:
+            # value isn't even of the right type
+            return False
+        return True
+
+# schema id -> {key: _KeyInfo}, key types only depend on the schema
+_key_info_cache = {}
+
+def _get_key_info(settings, key):
+    try:
+        infos = settings._key_infos
+    except AttributeError:
+        schema_id = settings.props.schema_id
+        infos = settings._key_infos = _key_info_cache.setdefault(schema_id, {})
+
+    try:
+        return infos[key]
+    except KeyError:
+        # set_value() aborts the program on an unknown key
+        if key not in settings:
+            raise KeyError('unknown key: %r' % (key,))
+        info = infos[key] = _KeyInfo(settings.get_range(key))
+        return info
+
 # Monkey patch Gio.Settings object
 def __setitem__(self, key, value):
-    # set_value() aborts the program on an unknown key
-    if key not in self:
-        raise KeyError('unknown key: %r' % (key,))
-
-    # determine type string of this key
-    range = self.get_range(key)
-    type_ = range.get_child_value(0).get_string()
-    v = range.get_child_value(1)
-    if type_ == 'type':
-        # v is boxed empty array, type of its elements is the allowed value type
-        assert v.get_child_value(0).get_type_string().startswith('a')
-        type_str = v.get_child_value(0).get_type_string()[1:]
-    elif type_ == 'enum':
-        # v is an array with the allowed values
-        assert v.get_child_value(0).get_type_string().startswith('a')
-        type_str = v.get_child_value(0).get_child_value(0).get_type_string()
-    elif type_ == 'flags':
-        # v is an array with the allowed values
-        assert v.get_child_value(0).get_type_string().startswith('a')
-        type_str = v.get_child_value(0).get_type_string()
-    elif type_ == 'range':
-        # type_str is a tuple giving the range
-        assert v.get_child_value(0).get_type_string().startswith('(')
-        type_str = v.get_child_value(0).get_type_string()[1]
-
-    if not self.set_value(key, GLib.Variant(type_str, value)):
+    info = _get_key_info(self, key)
+
+    # Reject invalid values before reaching the backend
+    if not info.validate(value):
+        raise ValueError("value '%s' for key '%s' is outside of valid range" % (value, key))
+
+    if _batch_depth > 0:
+        _join_batch(self)
+
+    if not self.set_value(key, GLib.Variant(info.type_str, value)):
         raise ValueError("value '%s' for key '%s' is outside of valid range" % (value, key))
 
+def validate(self, key, value):
+    """Return whether value is within the range, choices or flags allowed for
+    key, without writing it. Raises KeyError for unknown keys."""
+    return _get_key_info(self, key).validate(value)
+
 def bind_with_mapping(self, key, widget, prop, flags, key_to_prop, prop_to_key):
     self._ignore_key_changed = False
 
@@ -66,6 +123,7 @@ def bind_with_mapping(self, key, widget, prop, flags, key_to_prop, prop_to_key):
 
 Gio.Settings.bind_with_mapping = bind_with_mapping
 Gio.Settings.__setitem__ = __setitem__
+Gio.Settings.validate = validate
 
 class BinFileMonitor(GObject.GObject):
     __gsignals__ = {
@@ -74,8 +132,6 @@ class BinFileMonitor(GObject.GObject):
     def __init__(self):
         super(BinFileMonitor, self).__init__()
 
-        self.changed_id = 0
-
         env = GLib.getenv("PATH")
 
         if env == None:
@@ -91,17 +147,9 @@ class BinFileMonitor(GObject.GObject):
             mon.connect("changed", self.queue_emit_changed)
             self.monitors.append(mon)
 
-    def _emit_changed(self):
-        self.emit("changed")
-        self.changed_id = 0
-        return False
-
+    @coalesce_idle
     def queue_emit_changed(self, file, other, event_type, data=None):
-        if self.changed_id > 0:
-            GLib.source_remove(self.changed_id)
-            self.changed_id = 0
-
-        self.changed_id = GLib.idle_add(self._emit_changed)
+        self.emit("changed")
 
 file_monitor = None
 
@@ -113,6 +161,250 @@ def get_file_monitor():
 
     return file_monitor
 
+# Delayed apply
+#
+# By default every widget writes its key as soon as it changes. In delayed
+# apply mode, the Settings objects shared by the GSettings widgets keep
+# changes in memory (see Gio.Settings.delay()) until apply_settings() writes
+# them all to the backend at once. Unless auto_apply is None, pending changes
+# are also applied automatically, auto_apply ms after the first one (0 meaning
+# as soon as the main loop is idle).
+#
+# settings_batch() groups changes made by a block of code to some Settings
+# objects: they are applied together at the end of the block, or reverted if
+# it raises. It doesn't need delayed apply mode, Settings objects which are
+# only delayed for a batch write their later changes right away.
+
+_delayed_apply = False
+_auto_apply = 0
+_auto_apply_id = 0
+_batch_depth = 0
+_batch_settings = []
+# Every Settings object switched to delayed apply mode, for a batch or not,
+# whether it's shared by the widgets or not
+_delayed_settings = set()
+
+def _get_settings(schema):
+    settings = get_settings(schema)
+    if _delayed_apply:
+        _delay_settings(settings)
+    if _batch_depth > 0:
+        _join_batch(settings)
+    return settings
+
+def _delay_settings(settings):
+    if settings in _delayed_settings:
+        return
+    _delayed_settings.add(settings)
+    settings.delay()
+    settings.connect("notify::has-unapplied", _on_has_unapplied_changed)
+
+def _join_batch(settings):
+    if settings in _batch_settings:
+        return
+
+    # Changes made before the batch aren't part of it
+    if settings.get_has_unapplied():
+        settings.apply()
+
+    _delay_settings(settings)
+    _batch_settings.append(settings)
+
+def _end_batch(apply):
+    global _batch_settings
+
+    batch = _batch_settings
+    _batch_settings = []
+    for settings in batch:
+        if settings.get_has_unapplied():
+            if apply:
+                settings.apply()
+            else:
+                settings.revert()
+
+def _on_has_unapplied_changed(settings, pspec):
+    if not settings.get_has_unapplied() or settings in _batch_settings:
+        return
+
+    if _delayed_apply:
+        _queue_auto_apply()
+    else:
+        # Only delayed for a batch which is over
+        settings.apply()
+
+def _queue_auto_apply():
+    global _auto_apply_id
+
+    if _auto_apply is None or _auto_apply_id > 0:
+        return
+
+    if _auto_apply == 0:
+        _auto_apply_id = GLib.idle_add(_on_auto_apply)
+    else:
+        _auto_apply_id = GLib.timeout_add(_auto_apply, _on_auto_apply)
+
+def _on_auto_apply():
+    global _auto_apply_id
+
+    _auto_apply_id = 0
+    # Changes in a running batch wait for its end
+    for settings in list(_delayed_settings):
+        if settings.get_has_unapplied() and settings not in _batch_settings:
+            settings.apply()
+    return False
+
+def enable_delayed_apply(auto_apply=0):
+    """Switch the Settings objects of the GSettings widgets, current and future
+    ones, to delayed apply mode. This can't be undone, as Gio.Settings can't
+    leave that mode, but enable_delayed_apply(0) gets close to immediate
+    writes."""
+    global _delayed_apply, _auto_apply
+
+    _delayed_apply = True
+    _auto_apply = auto_apply
+
+    for settings in list(settings_objects.values()):
+        _delay_settings(settings)
+
+    if has_unapplied_settings():
+        _queue_auto_apply()
+
+def has_unapplied_settings():
+    return any(settings.get_has_unapplied() for settings in _delayed_settings)
+
+def apply_settings():
+    """Write all pending changes to the backend."""
+    global _auto_apply_id
+
+    if _auto_apply_id > 0:
+        GLib.source_remove(_auto_apply_id)
+        _auto_apply_id = 0
+
+    for settings in list(_delayed_settings):
+        if settings.get_has_unapplied():
+            settings.apply()
+
+def revert_settings():
+    """Drop all pending changes, widgets go back to the stored values."""
+    global _auto_apply_id
+
+    if _auto_apply_id > 0:
+        GLib.source_remove(_auto_apply_id)
+        _auto_apply_id = 0
+
+    for settings in list(_delayed_settings):
+        if settings.get_has_unapplied():
+            settings.revert()
+
+@contextlib.contextmanager
+def settings_batch(*settings):
+    """Context manager applying the changes made in its block in one go:
+
+        with settings_batch("org.cinnamon.desktop.interface"):
+            for widget, value in changes:
+                widget.set_value(value)
+
+    The batch covers the given Gio.Settings objects or schema ids, and the
+    ones written with settings[key] = value or used by GSettings widgets
+    created in the block. Their pending changes are applied when it starts,
+    so an exception only reverts what the block changed. Nested batches are
+    applied with the outermost one."""
+    global _batch_depth
+
+    _batch_depth += 1
+    try:
+        for item in settings:
+            _join_batch(_get_settings(item) if isinstance(item, str) else item)
+        yield
+    except:
+        _batch_depth -= 1
+        if _batch_depth == 0:
+            _end_batch(False)
+        raise
+    else:
+        _batch_depth -= 1
+        if _batch_depth == 0:
+            _end_batch(True)
+
+# Profiles
+#
+# A profile holds the values of the keys of several schemas, as a GVariant
+# of type a{sa{sv}} (schema id -> key -> value). Only keys which were changed
+# from their default value are stored.
+
+PROFILE_TYPE = "a{sa{sv}}"
+
+def _is_profile_schema(schema):
+    # Gio.Settings.new() aborts the program on schemas which aren't installed
+    # and on relocatable ones, which have no path of their own
+    source = Gio.SettingsSchemaSource.get_default()
+    if source is None:
+        return False
+    settings_schema = source.lookup(schema, True)
+    return settings_schema is not None and settings_schema.get_path() is not None
+
+def export_settings(schemas=None, binary=False):
+    """Return a profile of the schemas used by the GSettings widgets, or of the
+    given schema ids, in GVariant text format or, with binary, as bytes."""
+    if schemas is None:
+        schemas = list(settings_objects.keys())
+
+    profile = {}
+    for schema in schemas:
+        if not _is_profile_schema(schema):
+            continue
+        settings = _get_settings(schema)
+        values = {}
+        for key in settings.props.settings_schema.list_keys():
+            value = settings.get_user_value(key)
+            if value is not None:
+                values[key] = value
+        profile[schema] = values
+
+    variant = GLib.Variant(PROFILE_TYPE, profile)
+    if binary:
+        return variant.get_data_as_bytes().get_data()
+    return variant.print_(True)
+
+def import_settings(data):
+    """Restore a profile made by export_settings(), as a single delayed apply
+    transaction. Keys of the profile's schemas which aren't in the profile are
+    reset to their default value. Schemas which aren't installed or are
+    relocatable, keys which aren't writable and values of the wrong type or
+    out of range are skipped."""
+    variant_type = GLib.VariantType.new(PROFILE_TYPE)
+    if isinstance(data, (bytes, bytearray)):
+        profile = GLib.Variant.new_from_bytes(variant_type, GLib.Bytes.new(data), False)
+    else:
+        profile = GLib.Variant.parse(variant_type, data, None, None)
+
+    profiles = {}
+    for i in range(profile.n_children()):
+        entry = profile.get_child_value(i)
+        schema = entry.get_child_value(0).get_string()
+        if not _is_profile_schema(schema):
+            continue
+
+        values = profiles[schema] = {}
+        entries = entry.get_child_value(1)
+        for j in range(entries.n_children()):
+            key_value = entries.get_child_value(j)
+            values[key_value.get_child_value(0).get_string()] = key_value.get_child_value(1).get_variant()
+
+    with settings_batch(*profiles.keys()):
+        for schema, values in profiles.items():
+            settings = _get_settings(schema)
+            schema_keys = settings.props.settings_schema
+            for key in schema_keys.list_keys():
+                if not settings.is_writable(key):
+                    continue
+                value = values.get(key)
+                if value is None:
+                    settings.reset(key)
+                elif value.get_type_string() == schema_keys.get_key(key).get_value_type().dup_string() and \
+                     _get_key_info(settings, key).validate(value.unpack()):
+                    settings.set_value(key, value)
+
 # This class is not meant to be used directly - it is only a backend for the
 # settings widgets to enable them to bind attributes to gsettings keys. To use
 # the gesttings backend, simply add the "GSettings" prefix to the beginning
@@ -180,9 +472,7 @@ def g_settings_factory(subclass):
     class NewClass(globals()[subclass], PXGSettingsBackend):
         def __init__(self, label, schema, key, *args, **kwargs):
             self.key = key
-            if schema not in settings_objects:
-                settings_objects[schema] = Gio.Settings.new(schema)
-            self.settings = settings_objects[schema]
+            self.settings = _get_settings(schema)
 
             if "map_get" in kwargs:
                 self.map_get = kwargs["map_get"]
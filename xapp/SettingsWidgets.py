@@ -1,13 +1,77 @@
 #!/usr/bin/python3
 
 import math
+import weakref
 import gi
 gi.require_version('Gtk', '3.0')
 gi.require_version('XApp', '1.0')
 from gi.repository import Gio, Gtk, GObject, Gdk, GLib, XApp
+from xapp.threading import debounce
 
 settings_objects = {}
 
+class SettingsRegistry(object):
+    """Shares Gio.Settings objects between widgets, by schema id and path
+    (for relocatable schemas).
+
+    acquire() returns the shared object, creating it if needed. The registry
+    keeps it alive until each acquire() was matched by a release(), then only
+    holds a weak reference to it, so it is still shared while something else
+    uses it."""
+
+    def __init__(self):
+        self.settings = weakref.WeakValueDictionary()
+        self.held = {}
+        self.n_created = 0
+        self.n_reused = 0
+
+    def acquire(self, schema, path=None):
+        key = (schema, path)
+        settings = self.settings.get(key)
+        if settings is None:
+            if path is None:
+                settings = Gio.Settings.new(schema)
+            else:
+                settings = Gio.Settings.new_with_path(schema, path)
+            settings._registry_key = key
+            self.settings[key] = settings
+            self.n_created += 1
+        else:
+            self.n_reused += 1
+
+        held = self.held.setdefault(key, [settings, 0])
+        held[1] += 1
+        return settings
+
+    def release(self, settings):
+        key = settings._registry_key
+        held = self.held.get(key)
+        if held is None:
+            return
+        held[1] -= 1
+        if held[1] == 0:
+            del self.held[key]
+
+    def get_stats(self):
+        """Return how many Settings objects were created, how many requests
+        were served with an existing one, and how many are alive."""
+        return {
+            "created": self.n_created,
+            "reused": self.n_reused,
+            "alive": len(self.settings),
+        }
+
+settings_registry = SettingsRegistry()
+
+def get_settings(schema):
+    """Return the Settings object for schema shared by the settings widgets,
+    which is kept (in settings_objects) for the lifetime of the app."""
+    try:
+        return settings_objects[schema]
+    except KeyError:
+        settings = settings_objects[schema] = settings_registry.acquire(schema)
+        return settings
+
 class EditableEntry (Gtk.Stack):
 
     __gsignals__ = {
@@ -99,18 +163,29 @@ class SettingsRevealer(Gtk.Revealer):
         self.set_transition_duration(150)
 
         if schema:
-            self.settings = Gio.Settings.new(schema)
+            self.settings = settings_registry.acquire(schema)
+            self.changed_id = 0
+            self.connect("destroy", self._on_destroy)
             # if there aren't values or a function provided to determine visibility we can do a simple bind
             if values is None and check_func is None:
                 self.settings.bind(key, self, "reveal-child", Gio.SettingsBindFlags.GET)
             else:
                 self.values = values
-                self.settings.connect("changed::" + key, self.on_settings_changed)
+                self.changed_id = self.settings.connect("changed::" + key, self.on_settings_changed)
                 self.on_settings_changed(self.settings, key)
 
     def add(self, widget):
         self.box.pack_start(widget, False, True, 0)
 
+    def _on_destroy(self, widget):
+        # The shared settings object outlives us, don't leave handlers behind
+        if self.changed_id > 0:
+            self.settings.disconnect(self.changed_id)
+            self.changed_id = 0
+        else:
+            Gio.Settings.unbind(self, "reveal-child")
+        settings_registry.release(self.settings)
+
     #only used when checking values
     def on_settings_changed(self, settings, key):
         value = settings.get_value(key).unpack()
@@ -277,8 +352,9 @@ class SettingsWidget(Gtk.Box):
             flag |= Gio.SettingsBindFlags.INVERT_BOOLEAN
 
         split = dep_key.split("/")
-        dep_settings = Gio.Settings.new(split[0])
+        dep_settings = settings_registry.acquire(split[0])
         dep_settings.bind(split[1], self, "sensitive", flag)
+        self.connect("destroy", lambda widget: settings_registry.release(dep_settings))
 
     def add_to_size_group(self, group):
         group.add_widget(self.content_widget)
@@ -289,12 +365,7 @@ class SettingsWidget(Gtk.Box):
         self.set_margin_right(0)
 
     def get_settings(self, schema):
-        global settings_objects
-        try:
-            return settings_objects[schema]
-        except:
-            settings_objects[schema] = Gio.Settings.new(schema)
-            return settings_objects[schema]
+        return get_settings(schema)
 
 class SettingsLabel(Gtk.Label):
     def __init__(self, text=None):
@@ -333,8 +404,6 @@ class SpinButton(SettingsWidget):
     def __init__(self, label, units="", mini=None, maxi=None, step=1, page=None, size_group=None, dep_key=None, tooltip=""):
         super(SpinButton, self).__init__(dep_key=dep_key)
 
-        self.timer = None
-
         if units:
             label += " (%s)" % units
         self.label = SettingsLabel(label)
@@ -369,14 +438,9 @@ class SpinButton(SettingsWidget):
         if size_group:
             self.add_to_size_group(size_group)
 
+    @debounce(300)
     def apply_later(self, *args):
-        def apply(self):
-            self.set_value(self.content_widget.get_value())
-            self.timer = None
-
-        if self.timer:
-            GLib.source_remove(self.timer)
-        self.timer = GLib.timeout_add(300, apply, self)
+        self.set_value(self.content_widget.get_value())
 
 class Entry(SettingsWidget):
     bind_prop = "text"
@@ -479,7 +543,6 @@ class Range(SettingsWidget):
         self.log = log
         self.invert = invert
         self.flipped = flipped
-        self.timer = None
         self.value = 0
         self.digits = digits
         self.units = units
@@ -564,20 +627,15 @@ class Range(SettingsWidget):
             return True
         return False
 
+    @debounce(300)
     def apply_later(self, *args):
-        def apply(self):
-            if self.log:
-                self.set_value(math.exp(abs(self.content_widget.get_value())))
+        if self.log:
+            self.set_value(math.exp(abs(self.content_widget.get_value())))
+        else:
+            if self.flipped:
+                self.set_value(self.content_widget.get_value() * -1)
             else:
-                if self.flipped:
-                    self.set_value(self.content_widget.get_value() * -1)
-                else:
-                    self.set_value(self.content_widget.get_value())
-            self.timer = None
-
-        if self.timer:
-            GLib.source_remove(self.timer)
-        self.timer = GLib.timeout_add(300, apply, self)
+                self.set_value(self.content_widget.get_value())
 
     def on_scroll_event(self, widget, event):
         found, delta_x, delta_y = event.get_scroll_deltas()
@@ -1,8 +1,16 @@
 from __future__ import absolute_import
 
+import fnmatch
+import ipaddress
+import json
 import os
-import psutil
+import re
+import shutil
 import subprocess
+import sys
+import threading
+import time
+import urllib.parse
 
 ### SESSION DETECTION
 
@@ -13,7 +21,7 @@ SESSION_KDE = "KDE"
 SESSION_GNOME = "GNOME"
 SESSION_UNKNOWN = ""
 
-def get_current_desktop():
+def _detect_desktop():
 
     session = os.getenv("XDG_CURRENT_DESKTOP", SESSION_UNKNOWN)
 
@@ -26,46 +34,389 @@ def get_current_desktop():
 
     return SESSION_UNKNOWN
 
+def _detect_live_session():
+    for boot in get_kernel_cmdline().get_all("boot"):
+        if boot in ("casper", "live"):
+            return True
+    return False
+
+def _detect_guest_session():
+    home_path = os.path.expanduser("~")
+    if "/tmp/guest" in home_path:
+        return True
+    else:
+        return False
+
+def parse_kernel_cmdline(cmdline):
+    """Split a kernel command line into a list of (key, value) tuples,
+    value being None for parameters without '='. Like the kernel, double
+    quotes group words containing spaces and are removed."""
+    params = []
+    token = ""
+    in_token = False
+    in_quotes = False
+
+    for char in cmdline + " ":
+        if char == '"':
+            in_quotes = not in_quotes
+            in_token = True
+        elif char.isspace() and not in_quotes:
+            if in_token:
+                key, sep, value = token.partition("=")
+                params.append((key, value if sep else None))
+                token = ""
+                in_token = False
+        else:
+            token += char
+            in_token = True
+
+    return params
+
+class KernelCmdline(object):
+    """Parsed kernel command line, see get_kernel_cmdline()."""
+
+    def __init__(self, params):
+        self.params = params
+
+    def __contains__(self, key):
+        return any(k == key for k, v in self.params)
+
+    def get(self, key, default=None):
+        # When a parameter is repeated, the last one wins
+        for k, v in reversed(self.params):
+            if k == key:
+                return v
+        return default
+
+    def get_all(self, key):
+        return [v for k, v in self.params if k == key]
+
+_kernel_cmdline = None
+
+def get_kernel_cmdline():
+    """Return the KernelCmdline of the running kernel. /proc/cmdline is
+    only read once, it can't change while we're running."""
+    global _kernel_cmdline
+
+    if _kernel_cmdline is None:
+        try:
+            with open("/proc/cmdline", "r") as f:
+                cmdline = f.read()
+        except OSError:
+            cmdline = ""
+        _kernel_cmdline = KernelCmdline(parse_kernel_cmdline(cmdline))
+    return _kernel_cmdline
+
+class SessionInfo(object):
+    """Information about the current session. Each value is computed the
+    first time it is read and cached until refresh() is called."""
+
+    def __init__(self):
+        self._values = {}
+
+    def _get(self, key, detect_func):
+        try:
+            return self._values[key]
+        except KeyError:
+            value = self._values[key] = detect_func()
+            return value
+
+    @property
+    def desktop(self):
+        return self._get("desktop", _detect_desktop)
+
+    @property
+    def live_session(self):
+        return self._get("live_session", _detect_live_session)
+
+    @property
+    def guest_session(self):
+        return self._get("guest_session", _detect_guest_session)
+
+    @property
+    def polkit_running(self):
+        return self._get("polkit_running", is_polkit_running)
+
+    def refresh(self):
+        self._values = {}
+
+_session_info = SessionInfo()
+
+def get_session_info():
+    return _session_info
+
+def refresh_session_info():
+    _session_info.refresh()
+
+def get_current_desktop():
+    return _session_info.desktop
+
 def is_desktop_cinnamon():
-    return get_current_desktop() == SESSION_CINNAMON
+    return _session_info.desktop == SESSION_CINNAMON
 
 def is_desktop_mate():
-    return get_current_desktop() == SESSION_MATE
+    return _session_info.desktop == SESSION_MATE
 
 def is_desktop_xfce():
-    return get_current_desktop() == SESSION_XFCE
+    return _session_info.desktop == SESSION_XFCE
 
 def is_desktop_kde():
-    return get_current_desktop() == SESSION_KDE
+    return _session_info.desktop == SESSION_KDE
 
 def is_desktop_gnome():
-    return get_current_desktop() == SESSION_GNOME
+    return _session_info.desktop == SESSION_GNOME
 
 def is_live_session():
-    is_live_session = False
-    if os.access("/proc/cmdline", os.R_OK):
-        cmdline = subprocess.check_output("cat /proc/cmdline", shell = True).decode("utf-8")
-        for keyword in ["boot=casper", "boot=live"]:
-            if keyword in cmdline:
-                is_live_session = True
-                break
-    return is_live_session
+    return _session_info.live_session
 
 def is_guest_session():
-    home_path = os.path.expanduser("~")
-    if "/tmp/guest" in home_path:
-        return True
-    else:
-        return False
+    return _session_info.guest_session
 
 ### PROCESS DETECTION
 
-def is_process_running(process_name):
-    for pid in psutil.pids():
-        p = psutil.Process(pid)
-        if p.name() == process_name:
-            return True
-    return False
+# Number of seconds a process table snapshot is shared between callers
+# before /proc is scanned again.
+PROCESS_TABLE_MAX_AGE = 1.0
+
+class ProcessTable(object):
+    """A snapshot of the running processes, indexed by process name."""
+
+    def __init__(self, processes, timestamp):
+        # process name -> set of pids
+        self.processes = processes
+        # When the scan started, a process may have changed while it ran
+        self.timestamp = timestamp
+
+    def __contains__(self, name):
+        return name in self.processes
+
+    def get_age(self):
+        return time.monotonic() - self.timestamp
+
+    def get_names(self):
+        return list(self.processes.keys())
+
+    def get_pids(self, name):
+        return sorted(self.processes.get(name, ()))
+
+PROCESS_BACKEND_PROC = "proc"
+PROCESS_BACKEND_PSUTIL = "psutil"
+
+# The kernel truncates /proc/<pid>/comm to 15 characters
+_COMM_MAX_LENGTH = 15
+
+def _read_proc_file(path, size=4096):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.read(fd, size)
+    finally:
+        os.close(fd)
+
+def _read_proc_name(pid):
+    name = _read_proc_file("/proc/%s/comm" % pid).rstrip(b"\n")
+
+    if len(name) >= _COMM_MAX_LENGTH:
+        # Same as psutil - complete a truncated name using the command line
+        try:
+            argv0 = _read_proc_file("/proc/%s/cmdline" % pid).split(b"\0", 1)[0]
+        except OSError:
+            argv0 = b""
+        extended_name = os.path.basename(argv0)
+        if extended_name.startswith(name):
+            name = extended_name
+
+    return name.decode("utf-8", "surrogateescape")
+
+def _scan_processes_proc():
+    processes = {}
+    with os.scandir("/proc") as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+            try:
+                name = _read_proc_name(entry.name)
+            except OSError:
+                # The process exited, or we can't read it
+                continue
+            if name:
+                processes.setdefault(name, set()).add(int(entry.name))
+    return processes
+
+def _scan_processes_psutil():
+    import psutil
+
+    processes = {}
+    # process_iter() skips processes which exit while we iterate and
+    # sets the name to None when we're not allowed to read it.
+    for process in psutil.process_iter(["name"]):
+        name = process.info["name"]
+        if name:
+            processes.setdefault(name, set()).add(process.pid)
+    return processes
+
+_process_backend = None
+
+def get_process_backend():
+    global _process_backend
+
+    if _process_backend is None:
+        if os.path.isdir("/proc/self"):
+            _process_backend = PROCESS_BACKEND_PROC
+        else:
+            _process_backend = PROCESS_BACKEND_PSUTIL
+    return _process_backend
+
+def set_process_backend(backend):
+    """Select how the process table is read: PROCESS_BACKEND_PROC reads
+    /proc directly, PROCESS_BACKEND_PSUTIL goes through psutil."""
+    global _process_backend
+
+    if backend not in (PROCESS_BACKEND_PROC, PROCESS_BACKEND_PSUTIL):
+        raise ValueError("unknown process backend: %r" % (backend,))
+    _process_backend = backend
+    invalidate_process_table()
+
+def _scan_processes():
+    if get_process_backend() == PROCESS_BACKEND_PROC:
+        return _scan_processes_proc()
+    return _scan_processes_psutil()
+
+_process_table = None
+_process_table_lock = threading.Lock()
+
+def get_process_table(max_age=PROCESS_TABLE_MAX_AGE):
+    """Return a ProcessTable snapshot, scanning /proc only if the cached
+    one is older than max_age seconds."""
+    global _process_table
+
+    with _process_table_lock:
+        if _process_table is None or _process_table.get_age() > max_age:
+            timestamp = time.monotonic()
+            _process_table = ProcessTable(_scan_processes(), timestamp)
+        return _process_table
+
+def invalidate_process_table():
+    global _process_table
+
+    with _process_table_lock:
+        _process_table = None
+
+def find_processes(names, max_age=PROCESS_TABLE_MAX_AGE):
+    """Look up several process names with a single scan. Returns a dict
+    mapping each name to a (possibly empty) list of pids."""
+    table = get_process_table(max_age)
+    return {name: table.get_pids(name) for name in names}
+
+def is_process_running(process_name, max_age=PROCESS_TABLE_MAX_AGE):
+    return process_name in get_process_table(max_age)
+
+### PROCESS WATCHING
+
+# Interval in ms between two process table scans while watchers are active
+PROCESS_WATCH_INTERVAL = 1000
+
+class _ProcessScanner(object):
+    # Scans the process table on behalf of every started ProcessWatcher,
+    # so any number of watchers cost one scan per interval.
+
+    def __init__(self):
+        self.watchers = []
+        self.source_id = 0
+
+    def add_watcher(self, watcher):
+        from gi.repository import GLib
+
+        if watcher not in self.watchers:
+            self.watchers.append(watcher)
+        if self.source_id == 0:
+            self.source_id = GLib.timeout_add(PROCESS_WATCH_INTERVAL, self._on_timeout)
+
+    def remove_watcher(self, watcher):
+        from gi.repository import GLib
+
+        if watcher in self.watchers:
+            self.watchers.remove(watcher)
+        if not self.watchers and self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self.source_id = 0
+
+    def get_table(self):
+        # Reuse a recent snapshot taken by anyone else, but not one from the
+        # previous tick, or changes would only be seen every other interval
+        return get_process_table(PROCESS_WATCH_INTERVAL / 2000.0)
+
+    def _on_timeout(self):
+        table = self.get_table()
+        for watcher in list(self.watchers):
+            watcher._update(table)
+        return True
+
+_process_scanner = _ProcessScanner()
+
+def _create_process_watcher_class():
+    from gi.repository import GObject
+
+    class ProcessWatcher(GObject.Object):
+        """Emits 'appeared' and 'vanished' when a process with one of the
+        watched names starts or stops. Processes which are already running
+        when a name is added are not signalled, use is_running() for that."""
+
+        __gsignals__ = {
+            'appeared': (GObject.SignalFlags.RUN_LAST, None, (str,)),
+            'vanished': (GObject.SignalFlags.RUN_LAST, None, (str,)),
+        }
+
+        def __init__(self, names=()):
+            super(ProcessWatcher, self).__init__()
+
+            self.running = {}
+            self.started = False
+
+            for name in names:
+                self.add_name(name)
+
+        def add_name(self, name):
+            if name not in self.running:
+                self.running[name] = name in _process_scanner.get_table()
+
+        def remove_name(self, name):
+            self.running.pop(name, None)
+
+        def get_names(self):
+            return list(self.running.keys())
+
+        def is_running(self, name):
+            return self.running.get(name, False)
+
+        def start(self):
+            if not self.started:
+                self.started = True
+                self._update(_process_scanner.get_table())
+                _process_scanner.add_watcher(self)
+
+        def stop(self):
+            if self.started:
+                self.started = False
+                _process_scanner.remove_watcher(self)
+
+        def _update(self, table):
+            for name, was_running in list(self.running.items()):
+                running = name in table
+                if running == was_running:
+                    continue
+                self.running[name] = running
+                self.emit("appeared" if running else "vanished", name)
+
+    return ProcessWatcher
+
+# ProcessWatcher is a GObject, create it on first use so that importing
+# this module doesn't require gi.
+def __getattr__(name):
+    if name == "ProcessWatcher":
+        cls = _create_process_watcher_class()
+        globals()["ProcessWatcher"] = cls
+        return cls
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 ### POLKIT SUPPORT
 
@@ -75,14 +426,16 @@ def is_polkit_running():
     if not os.path.exists("/usr/bin/pkexec"):
         return False
 
-    # Check that the polkit agent is running
-    if is_desktop_kde() and is_process_running("polkit-kde-authentication-agent-1"):
+    # Check that the polkit agent is running, all lookups share one scan
+    processes = get_process_table()
+    desktop = _session_info.desktop
+    if desktop == SESSION_KDE and "polkit-kde-authentication-agent-1" in processes:
         return True
-    if is_desktop_mate() and is_process_running("polkit-mate-authentication-agent-1"):
+    if desktop == SESSION_MATE and "polkit-mate-authentication-agent-1" in processes:
         return True
-    elif is_process_running("polkit-gnome-authentication-agent-1"):
+    elif "polkit-gnome-authentication-agent-1" in processes:
         return True
-    elif is_process_running("polkitd"):
+    elif "polkitd" in processes:
         return True
     else:
         return False
@@ -93,45 +446,321 @@ def pkexec(command):
 
     subprocess.call(["/usr/bin/pkexec"] + command)
 
-### Run as root
+### ASYNCHRONOUS EXECUTION
 
-def run_with_admin_privs(command, message=None, icon=None, support_pkexec=False):
+class AsyncProcess(object):
+    """A command running in the background, without blocking the main loop.
+
+    callback(status, stdout, stderr) is called from the main loop once the
+    command is done. status is its exit code, minus the number of the signal
+    which terminated it, or -1 if it couldn't be run. If it couldn't be
+    started at all, stderr holds the error message.
+
+    If output_callback(line, is_stderr) is given, the output is delivered
+    line by line while the command runs instead, and callback receives None
+    for stdout and stderr."""
+
+    def __init__(self, argv, callback=None, output_callback=None, stdin_data=None):
+        from gi.repository import Gio, GLib
+
+        self.callback = callback
+        self.output_callback = output_callback
+        self.status = -1
+        self.pending = 0
+        self.cancellable = Gio.Cancellable()
+
+        flags = Gio.SubprocessFlags.STDOUT_PIPE | Gio.SubprocessFlags.STDERR_PIPE
+        if stdin_data is not None:
+            flags |= Gio.SubprocessFlags.STDIN_PIPE
+
+        try:
+            self.subprocess = Gio.Subprocess.new(argv, flags)
+        except GLib.Error as e:
+            # Report it like any other failure, from the main loop
+            self.subprocess = None
+            GLib.idle_add(self._on_spawn_failed, e.message)
+            return
+
+        if output_callback is None:
+            self.subprocess.communicate_utf8_async(stdin_data, self.cancellable, self._on_communicated)
+            return
+
+        # stdout, stderr and the exit status, plus stdin if there's input
+        self.pending = 3
+        if stdin_data is not None:
+            self.pending += 1
+            self._write_stdin(stdin_data)
+        self._read_line(Gio.DataInputStream.new(self.subprocess.get_stdout_pipe()), False)
+        self._read_line(Gio.DataInputStream.new(self.subprocess.get_stderr_pipe()), True)
+        self.subprocess.wait_async(self.cancellable, self._on_waited)
+
+    def cancel(self):
+        # Best effort, a privileged process can't be killed by us
+        self.cancellable.cancel()
+        if self.subprocess is not None:
+            self.subprocess.force_exit()
+
+    def _get_status(self):
+        if self.subprocess.get_if_exited():
+            return self.subprocess.get_exit_status()
+        elif self.subprocess.get_if_signaled():
+            return -self.subprocess.get_term_sig()
+        return -1
+
+    def _finish(self, stdout, stderr):
+        if self.callback is not None:
+            self.callback(self.status, stdout, stderr)
+
+    def _on_spawn_failed(self, message):
+        self._finish(None, message)
+        return False
+
+    def _on_communicated(self, subprocess, result):
+        from gi.repository import GLib
+
+        try:
+            success, stdout, stderr = subprocess.communicate_utf8_finish(result)
+        except GLib.Error as e:
+            self._finish(None, e.message)
+            return
+
+        self.status = self._get_status()
+        self._finish(stdout, stderr)
+
+    def _write_stdin(self, data):
+        from gi.repository import Gio, GLib
+
+        source = Gio.MemoryInputStream.new_from_bytes(GLib.Bytes.new(data.encode("utf-8")))
+        self.subprocess.get_stdin_pipe().splice_async(source,
+                                                      Gio.OutputStreamSpliceFlags.CLOSE_SOURCE |
+                                                      Gio.OutputStreamSpliceFlags.CLOSE_TARGET,
+                                                      GLib.PRIORITY_DEFAULT,
+                                                      self.cancellable,
+                                                      self._on_stdin_written)
+
+    def _on_stdin_written(self, stream, result):
+        from gi.repository import GLib
+
+        try:
+            stream.splice_finish(result)
+        except GLib.Error:
+            # The command exited without reading its input
+            pass
+        self._complete_one()
+
+    def _read_line(self, stream, is_stderr):
+        from gi.repository import GLib
+
+        stream.read_line_async(GLib.PRIORITY_DEFAULT, self.cancellable, self._on_line_read, is_stderr)
+
+    def _on_line_read(self, stream, result, is_stderr):
+        from gi.repository import GLib
+
+        try:
+            line, length = stream.read_line_finish(result)
+        except GLib.Error:
+            line = None
+
+        if line is None:
+            stream.close(None)
+            self._complete_one()
+            return
+
+        self.output_callback(line.decode("utf-8", "replace"), is_stderr)
+        self._read_line(stream, is_stderr)
+
+    def _on_waited(self, subprocess, result):
+        from gi.repository import GLib
+
+        try:
+            subprocess.wait_finish(result)
+            self.status = self._get_status()
+        except GLib.Error:
+            pass
+        self._complete_one()
+
+    def _complete_one(self):
+        self.pending -= 1
+        if self.pending == 0:
+            self._finish(None, None)
+
+def pkexec_async(command, callback=None, output_callback=None):
+    """Non-blocking pkexec(), returns an AsyncProcess."""
     if not isinstance(command, list):
         command = command.split(" ")
 
-    if is_polkit_running() and support_pkexec:
-        pkexec(command)
-        return True
-    elif os.path.exists("/usr/bin/gksu"):
-        commands = ["gksu"]
-        if message is not None:
-            commands = commands + ["--message", "<b>%s</b>" % message]
-        commands = commands + command
-        subprocess.Popen(commands)
-        return True
-    elif os.path.exists("/usr/bin/kdesudo"):
-        commands = ["kdesudo", "-d"]
-        if icon is not None:
-            commands = commands + ["-i", icon]
-        if message is not None:
-            commands = commands + ["--comment", "<b>%s</b>" % message]
-        commands = commands + command
-        subprocess.Popen(commands)
-        return True
-    # Finally use pkexec if we have nothing else - it will work, but the executed program
-    # may not be properly localized.
-    elif is_polkit_running():
-        pkexec(command)
-        return True
-    else:
+    return AsyncProcess(["/usr/bin/pkexec"] + command, callback, output_callback)
+
+### BATCHED EXECUTION
+
+# Runs inside the privileged process: reads a JSON list of argvs from stdin
+# and writes a JSON list of [status, stdout, stderr] to stdout. The results
+# must always be written, so the caller knows which commands already ran.
+_ADMIN_BATCH_RUNNER = """
+import json, subprocess, sys
+commands, stop_on_error = json.load(sys.stdin)
+results = []
+for argv in commands:
+    try:
+        p = subprocess.run(argv, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                           stderr=subprocess.PIPE)
+        results.append([p.returncode,
+                        p.stdout.decode("utf-8", "replace"),
+                        p.stderr.decode("utf-8", "replace")])
+    except Exception as e:
+        results.append([-1, "", str(e)])
+    if stop_on_error and results[-1][0] != 0:
+        break
+json.dump(results, sys.stdout)
+"""
+
+class AdminBatch(object):
+    """Queue several commands and run them all as root with a single pkexec
+    call, so the user only has to authenticate once.
+
+    run() and run_async() return a list with a (status, stdout, stderr) tuple
+    per command, or None if the batch couldn't be run (for example if
+    authentication failed). With stop_on_error, the commands following a
+    failed one are skipped and have no result."""
+
+    def __init__(self, stop_on_error=False):
+        self.stop_on_error = stop_on_error
+        self.commands = []
+
+    def add(self, command):
+        if not isinstance(command, list):
+            command = command.split(" ")
+        self.commands.append(command)
+
+    def _get_argv(self):
+        return ["/usr/bin/pkexec", sys.executable, "-c", _ADMIN_BATCH_RUNNER]
+
+    def _get_input(self):
+        return json.dumps([self.commands, self.stop_on_error])
+
+    def _parse_output(self, status, output):
+        if status != 0 or not output:
+            return None
+        try:
+            return [tuple(result) for result in json.loads(output)]
+        except ValueError:
+            return None
+
+    def run(self):
+        if not self.commands:
+            return []
+
+        p = subprocess.run(self._get_argv(), input=self._get_input(),
+                           stdout=subprocess.PIPE, universal_newlines=True)
+        return self._parse_output(p.returncode, p.stdout)
+
+    def run_async(self, callback):
+        """Non-blocking run(), callback(results) is called from the main loop."""
+        if not self.commands:
+            callback([])
+            return None
+
+        def on_done(status, stdout, stderr):
+            callback(self._parse_output(status, stdout))
+
+        return AsyncProcess(self._get_argv(), on_done, stdin_data=self._get_input())
+
+### Run as root
+
+ADMIN_TOOL_PKEXEC = "pkexec"
+ADMIN_TOOL_GKSU = "gksu"
+ADMIN_TOOL_KDESUDO = "kdesudo"
+
+class AdminBackend(object):
+    """The tools available to run commands as root. Their paths are looked up
+    once, use get_admin_backend() to get the current instance. Whether polkit
+    is running is checked on each call, its agent can start or stop."""
+
+    def __init__(self):
+        self.path = os.getenv("PATH")
+        self.gksu = shutil.which("gksu")
+        self.kdesudo = shutil.which("kdesudo")
+
+    def get_tool(self, support_pkexec=False):
+        polkit_running = is_polkit_running()
+        if polkit_running and support_pkexec:
+            return ADMIN_TOOL_PKEXEC
+        elif self.gksu is not None:
+            return ADMIN_TOOL_GKSU
+        elif self.kdesudo is not None:
+            return ADMIN_TOOL_KDESUDO
+        # Finally use pkexec if we have nothing else - it will work, but the executed program
+        # may not be properly localized.
+        elif polkit_running:
+            return ADMIN_TOOL_PKEXEC
+        else:
+            return None
+
+    def build_argv(self, command, message=None, icon=None, support_pkexec=False):
+        """Return the argv running command as root, or None if that's not possible."""
+        if not isinstance(command, list):
+            command = command.split(" ")
+
+        tool = self.get_tool(support_pkexec)
+        if tool == ADMIN_TOOL_PKEXEC:
+            return ["/usr/bin/pkexec"] + command
+        elif tool == ADMIN_TOOL_GKSU:
+            commands = [self.gksu]
+            if message is not None:
+                commands = commands + ["--message", "<b>%s</b>" % message]
+            return commands + command
+        elif tool == ADMIN_TOOL_KDESUDO:
+            commands = [self.kdesudo, "-d"]
+            if icon is not None:
+                commands = commands + ["-i", icon]
+            if message is not None:
+                commands = commands + ["--comment", "<b>%s</b>" % message]
+            return commands + command
+        else:
+            return None
+
+_admin_backend = None
+
+def get_admin_backend():
+    """Return the cached AdminBackend, detecting it again if PATH changed."""
+    global _admin_backend
+
+    if _admin_backend is None or _admin_backend.path != os.getenv("PATH"):
+        _admin_backend = AdminBackend()
+    return _admin_backend
+
+def refresh_admin_backend():
+    global _admin_backend
+
+    _admin_backend = None
+    return get_admin_backend()
+
+def run_with_admin_privs(command, message=None, icon=None, support_pkexec=False):
+    argv = get_admin_backend().build_argv(command, message, icon, support_pkexec)
+    if argv is None:
         return False
 
+    if argv[0] == "/usr/bin/pkexec":
+        subprocess.call(argv)
+    else:
+        subprocess.Popen(argv)
+    return True
+
+def run_with_admin_privs_async(command, message=None, icon=None, support_pkexec=False,
+                               callback=None, output_callback=None):
+    """Non-blocking run_with_admin_privs(), returns an AsyncProcess, or None
+    if there is no way to run the command as root."""
+    argv = get_admin_backend().build_argv(command, message, icon, support_pkexec)
+    if argv is None:
+        return None
+
+    return AsyncProcess(argv, callback, output_callback)
+
 ### NETWORK PROXY
 
 PROXY_SCHEMA = "org.gnome.system.proxy"
 
-def _build_proxy_url(parent_settings, scheme):
-    child = parent_settings.get_child(scheme)
+def _build_proxy_url(child, scheme):
     host = child.get_string("host")
 
     if not host:
@@ -185,10 +814,211 @@ def add_network_proxy_to_env():
     if settings.get_string("mode") != "manual":
         return
 
-    _maybe_set_env("http_proxy", _build_proxy_url(settings, "http"))
-    _maybe_set_env("https_proxy", _build_proxy_url(settings, "https"))
+    _maybe_set_env("http_proxy", _build_proxy_url(settings.get_child("http"), "http"))
+    _maybe_set_env("https_proxy", _build_proxy_url(settings.get_child("https"), "https"))
 
     if not os.environ.get("no_proxy") and not os.environ.get("NO_PROXY"):
         ignore_hosts = settings.get_strv("ignore-hosts")
         if ignore_hosts:
             os.environ["no_proxy"] = ",".join(ignore_hosts)
+
+class ProxyBypassMatcher(object):
+    """Decides which hosts are reached without a proxy, compiled from the
+    'ignore-hosts' list of the proxy schema. Entries can be IP addresses,
+    networks like 192.168.0.0/16, or domains, optionally with a port. Like
+    GSimpleProxyResolver, example.com, .example.com and *.example.com all
+    match example.com and all its subdomains.
+
+    should_bypass() costs a dict lookup per label of the host name, or one
+    set lookup per distinct prefix length for IP addresses, however long
+    the list is. Only wildcards other than a leading '*.' fall back to a
+    regular expression."""
+
+    def __init__(self, ignore_hosts):
+        # reversed domain labels, the None key of a node holds the ports
+        # the domain matches for, None in it meaning any port
+        self.domains = {}
+        # prefix length -> set of network addresses, per IP version
+        self.networks = {4: {}, 6: {}}
+        self.match_all = False
+        patterns = []
+
+        for entry in ignore_hosts:
+            entry = entry.strip().lower()
+            if not entry:
+                continue
+            if entry == "*":
+                self.match_all = True
+                continue
+            try:
+                network = ipaddress.ip_network(entry, strict=False)
+                prefixes = self.networks[network.version]
+                prefixes.setdefault(network.prefixlen, set()).add(int(network.network_address))
+                continue
+            except ValueError:
+                pass
+
+            port = None
+            host, sep, port_str = entry.rpartition(":")
+            if sep and port_str.isdigit():
+                entry = host
+                port = int(port_str)
+
+            domain = entry
+            if domain.startswith("*."):
+                domain = domain[2:]
+            domain = domain.strip(".")
+
+            if "*" in domain or "?" in domain:
+                patterns.append(fnmatch.translate(entry))
+            elif domain:
+                self._add_domain(domain, port)
+
+        self.pattern = re.compile("|".join(patterns)) if patterns else None
+
+    def _add_domain(self, domain, port):
+        node = self.domains
+        for label in reversed(domain.split(".")):
+            node = node.setdefault(label, {})
+        node.setdefault(None, set()).add(port)
+
+    def _match_domain(self, host, port):
+        node = self.domains
+        for label in reversed(host.split(".")):
+            node = node.get(label)
+            if node is None:
+                return False
+            ports = node.get(None)
+            if ports is not None and (None in ports or port in ports):
+                return True
+        return False
+
+    def _match_address(self, host):
+        try:
+            address = ipaddress.ip_address(host)
+        except ValueError:
+            return False
+
+        prefixes = self.networks[address.version]
+        value = int(address)
+        bits = address.max_prefixlen
+        for prefixlen, networks in prefixes.items():
+            mask = ((1 << prefixlen) - 1) << (bits - prefixlen)
+            if value & mask in networks:
+                return True
+        return False
+
+    def should_bypass(self, host, port=None):
+        if self.match_all:
+            return True
+
+        host = host.lower().strip("[]").rstrip(".")
+
+        if self.domains and self._match_domain(host, port):
+            return True
+        if (self.networks[4] or self.networks[6]) and self._match_address(host):
+            return True
+        if self.pattern is not None and self.pattern.match(host):
+            return True
+        return False
+
+class ProxyConfig(object):
+    """The system proxy configuration. GSettings is only read once, the
+    configuration is then kept up to date from its 'changed' signals.
+
+    With sync_environ, http_proxy, https_proxy and no_proxy in os.environ
+    follow the configuration. Like add_network_proxy_to_env(), variables
+    which were already set when the ProxyConfig was created are left
+    alone."""
+
+    SCHEMES = ("http", "https", "ftp", "socks")
+
+    def __init__(self, sync_environ=False):
+        from gi.repository import Gio
+
+        self.mode = "none"
+        self.urls = {}
+        self.ignore_hosts = []
+        self.bypass_matcher = ProxyBypassMatcher([])
+        self.settings = None
+        self.children = {}
+
+        self.environ_names = []
+        if sync_environ:
+            for name in ("http_proxy", "https_proxy", "no_proxy"):
+                if not os.environ.get(name) and not os.environ.get(name.upper()):
+                    self.environ_names.append(name)
+
+        source = Gio.SettingsSchemaSource.get_default()
+        if source is None or source.lookup(PROXY_SCHEMA, True) is None:
+            return
+
+        self.settings = Gio.Settings.new(PROXY_SCHEMA)
+        self.settings.connect("changed", self._on_settings_changed)
+        self.mode = self.settings.get_string("mode")
+        self._update_ignore_hosts()
+
+        for scheme in self.SCHEMES:
+            child = self.settings.get_child(scheme)
+            child.connect("changed", self._on_child_changed, scheme)
+            self.children[scheme] = child
+            self._update_url(scheme)
+
+        self._sync_environ()
+
+    def _update_ignore_hosts(self):
+        self.ignore_hosts = self.settings.get_strv("ignore-hosts")
+        self.bypass_matcher = ProxyBypassMatcher(self.ignore_hosts)
+
+    def _update_url(self, scheme):
+        child = self.children[scheme]
+        if scheme == "socks":
+            host = child.get_string("host")
+            port = child.get_int("port")
+            url = "socks://%s:%d" % (host, port) if host and port > 0 else None
+        else:
+            url = _build_proxy_url(child, scheme)
+        self.urls[scheme] = url
+
+    def _on_settings_changed(self, settings, key):
+        if key == "mode":
+            self.mode = settings.get_string("mode")
+        elif key == "ignore-hosts":
+            self._update_ignore_hosts()
+        else:
+            return
+        self._sync_environ()
+
+    def _on_child_changed(self, settings, key, scheme):
+        self._update_url(scheme)
+        self._sync_environ()
+
+    def _sync_environ(self):
+        manual = self.mode == "manual"
+        values = {
+            "http_proxy": self.urls.get("http"),
+            "https_proxy": self.urls.get("https"),
+            "no_proxy": ",".join(self.ignore_hosts),
+        }
+
+        for name in self.environ_names:
+            if manual and values[name]:
+                os.environ[name] = values[name]
+            else:
+                os.environ.pop(name, None)
+
+    def get_proxy_for_url(self, url):
+        """Return the URL of the proxy to use for url, or None to connect
+        directly. Only manual configuration is supported, None is returned
+        in automatic (PAC) mode."""
+        if self.mode != "manual":
+            return None
+
+        parts = urllib.parse.urlsplit(url)
+        if parts.hostname is None or self.bypass_matcher.should_bypass(parts.hostname, parts.port):
+            return None
+
+        proxy = self.urls.get(parts.scheme.lower())
+        if proxy is None:
+            proxy = self.urls.get("socks")
+        return proxy
@@ -1,21 +1,109 @@
+import functools
 import gi
+import importlib
 import threading
 
 from gi.repository import GLib
 
+from .debounce import coalesce_idle, debounce, throttle
+from .dispatcher import MainLoopDispatcher, get_dispatcher, get_idle_stats, set_frame_budget
+from .instrumentation import disable_instrumentation, dump_instrumentation, enable_instrumentation, \
+    get_instrumentation_report, reset_instrumentation
+from .pool import DEFAULT_POOL, Future, ThreadPool, configure_pool, get_pool
+from .serial import SerialQueue, get_serial_queue
+from .task import Task, TaskCancelledError, get_current_task, run_task
+
 # Decorator to run things in the background
-def run_async(func):
-    def wrapper(*args, **kwargs):
-        thread = threading.Thread(target=func, args=args, kwargs=kwargs)
-        thread.daemon = True
-        thread.start()
-        return thread
-    return wrapper
+#
+# Calls are run by a shared ThreadPool (see configure_pool()) and return a
+# Future, use its connect_result() method to get the result back in the
+# main loop. Use @run_async(pool="name") to run them in a separate pool, or
+# @run_async(thread=True) to start a new thread for every call and get the
+# threading.Thread back.
+#
+# With @run_async(serial="name"), calls go through the SerialQueue of that
+# name: they run one at a time, in order, while other queues and plain
+# run_async() calls still run in parallel.
+def run_async(func=None, pool=DEFAULT_POOL, thread=False, serial=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if thread:
+                new_thread = threading.Thread(target=func, args=args, kwargs=kwargs)
+                new_thread.daemon = True
+                new_thread.start()
+                return new_thread
+            if serial is not None:
+                return get_serial_queue(serial, pool).submit(func, *args, **kwargs)
+            return get_pool(pool).submit(func, *args, **kwargs)
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
 
 # Decorator to run things in the main Gtk loop
-def run_idle(func):
-    def wrapper(*args):
-        GLib.idle_add(func, *args)
-    return wrapper
+#
+# Calls are queued in the MainLoopDispatcher, which runs them from a single
+# idle source within a time budget per main loop iteration. With
+# @run_idle(coalesce=True), a call replaces the pending call of the same
+# function, whatever its arguments, so that only the latest one runs. To
+# coalesce by argument instead (e.g. per object), pass a function which
+# returns the key to use for given arguments.
+#
+# Use @run_idle(priority=GLib.PRIORITY_HIGH_IDLE) (or PRIORITY_DEFAULT,
+# PRIORITY_LOW...) to run the callbacks from a dispatcher at that priority.
+#
+# Calls made from the worker of a Task are dropped if the task is cancelled
+# before they run.
+def run_idle(func=None, coalesce=False, priority=GLib.PRIORITY_DEFAULT_IDLE):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            if callable(coalesce):
+                key = (func, coalesce(*args))
+            elif coalesce:
+                key = func
+            else:
+                key = None
+            task = get_current_task()
+            cancellable = task.cancellable if task is not None else None
+            get_dispatcher(priority).queue_call(func, args, key, cancellable)
+        return wrapper
+
+    if func is None:
+        return decorator
+    return decorator(func)
+
+# asyncio and multiprocessing are slow to import, only load the modules
+# using them when one of their functions is first used.
+_LAZY_ATTRIBUTES = {
+    "await_in_main": "aio",
+    "get_event_loop": "aio",
+    "run_coroutine": "aio",
+    "run_coroutine_idle": "aio",
+    "configure_process_pool": "process",
+    "run_in_process": "process",
+    "submit_to_process": "process",
+}
+
+def __getattr__(name):
+    try:
+        module_name = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    module = importlib.import_module("." + module_name, __name__)
+    value = getattr(module, name)
+    globals()[name] = value
+    return value
 
-__all__ = ["run_async", "run_idle"]
+__all__ = ["run_async", "run_idle", "Future", "ThreadPool", "get_pool", "configure_pool",
+           "MainLoopDispatcher", "get_dispatcher", "get_idle_stats", "set_frame_budget",
+           "get_event_loop", "run_coroutine", "run_coroutine_idle", "await_in_main",
+           "Task", "TaskCancelledError", "get_current_task", "run_task",
+           "run_in_process", "submit_to_process", "configure_process_pool",
+           "debounce", "throttle", "coalesce_idle",
+           "enable_instrumentation", "disable_instrumentation", "reset_instrumentation",
+           "get_instrumentation_report", "dump_instrumentation",
+           "SerialQueue", "get_serial_queue"]
@@ -0,0 +1,62 @@
+import asyncio
+import functools
+import threading
+
+from .dispatcher import get_dispatcher
+from .pool import wrap_future
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def get_event_loop():
+    """Return the asyncio event loop shared by the app, running in a daemon
+    thread of its own. Coroutines doing I/O all run there, instead of taking
+    a thread each like run_async() functions."""
+    global _loop
+
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=_loop.run_forever, name="xapp-asyncio")
+            thread.daemon = True
+            thread.start()
+        return _loop
+
+def run_coroutine(coro):
+    """Schedule coro on the shared event loop. Can be called from any thread,
+    returns a Future - use its connect_result() method to get the result of
+    the coroutine in the main loop."""
+    return wrap_future(asyncio.run_coroutine_threadsafe(coro, get_event_loop()),
+                       getattr(coro, "__qualname__", None))
+
+def run_coroutine_idle(coro, on_result=None, on_error=None):
+    """Schedule coro on the shared event loop and call on_result(result) or
+    on_error(exception) from the main loop when it's done."""
+    return run_coroutine(coro).connect_result(on_result, on_error)
+
+def _set_result(future, result):
+    if not future.cancelled():
+        future.set_result(result)
+
+def _set_exception(future, e):
+    if not future.cancelled():
+        future.set_exception(e)
+
+async def await_in_main(func, *args):
+    """Run func(*args) in the main loop and return its result. For use in
+    coroutines running on the shared event loop which need to touch widgets."""
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    @functools.wraps(func)
+    def call():
+        try:
+            result = func(*args)
+        except Exception as e:
+            loop.call_soon_threadsafe(_set_exception, future, e)
+        else:
+            loop.call_soon_threadsafe(_set_result, future, result)
+        return False
+
+    get_dispatcher().queue_call(call)
+    return await future
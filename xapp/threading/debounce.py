@@ -0,0 +1,211 @@
+import functools
+import time
+
+from gi.repository import GLib
+
+# These helpers are meant to be called from the main loop, the decorated
+# function always runs there.
+
+class _Debouncer(object):
+    def __init__(self, func, delay, leading, trailing, max_wait):
+        self.func = func
+        self.delay = delay
+        self.leading = leading
+        self.trailing = trailing
+        self.max_wait = max_wait
+        self.source_id = 0
+        self.pending_args = None
+        self.burst_start = 0
+
+    def __call__(self, *args):
+        now = time.monotonic()
+
+        if self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self.pending_args = args
+        else:
+            self.burst_start = now
+            if self.leading:
+                self.func(*args)
+            else:
+                self.pending_args = args
+
+        delay = self.delay
+        if self.max_wait is not None:
+            remaining = self.max_wait - (now - self.burst_start) * 1000
+            delay = max(0, min(delay, int(remaining)))
+
+        self.source_id = GLib.timeout_add(delay, self._on_timeout)
+
+    def _on_timeout(self):
+        self.source_id = 0
+        self.flush()
+        return False
+
+    def flush(self):
+        """Run the pending call now, if there is one."""
+        if self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self.source_id = 0
+
+        args = self.pending_args
+        self.pending_args = None
+        if args is not None and self.trailing:
+            self.func(*args)
+
+    def cancel(self):
+        """Drop the pending call, if there is one."""
+        if self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self.source_id = 0
+        self.pending_args = None
+
+class _Throttler(object):
+    def __init__(self, func, interval, leading, trailing):
+        self.func = func
+        self.interval = interval
+        self.leading = leading
+        self.trailing = trailing
+        self.source_id = 0
+        self.pending_args = None
+
+    def __call__(self, *args):
+        if self.source_id > 0:
+            self.pending_args = args
+            return
+
+        if self.leading:
+            self.func(*args)
+        else:
+            self.pending_args = args
+        self.source_id = GLib.timeout_add(self.interval, self._on_timeout)
+
+    def _on_timeout(self):
+        args = self.pending_args
+        self.pending_args = None
+        if args is not None and self.trailing:
+            self.func(*args)
+            # Keep throttling calls made right after this one
+            return True
+
+        self.source_id = 0
+        return False
+
+    def flush(self):
+        if self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self.source_id = 0
+
+        args = self.pending_args
+        self.pending_args = None
+        if args is not None and self.trailing:
+            self.func(*args)
+
+    def cancel(self):
+        if self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self.source_id = 0
+        self.pending_args = None
+
+class _IdleCoalescer(object):
+    def __init__(self, func):
+        self.func = func
+        self.source_id = 0
+        self.pending_args = None
+
+    def __call__(self, *args):
+        self.pending_args = args
+        if self.source_id == 0:
+            self.source_id = GLib.idle_add(self._on_idle)
+
+    def _on_idle(self):
+        self.source_id = 0
+        args = self.pending_args
+        self.pending_args = None
+        self.func(*args)
+        return False
+
+    def flush(self):
+        if self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self._on_idle()
+
+    def cancel(self):
+        if self.source_id > 0:
+            GLib.source_remove(self.source_id)
+            self.source_id = 0
+        self.pending_args = None
+
+class _RateLimited(object):
+    # Wraps a function or method. Methods get a rate limiter per instance,
+    # stored in the instance under the method name, also when called through
+    # the class as Class.method(instance).
+
+    def __init__(self, func, factory):
+        functools.update_wrapper(self, func)
+        self.func = func
+        self.factory = factory
+        self.name = func.__name__
+        self.owner = None
+        self.limiter = None
+
+    def __set_name__(self, owner, name):
+        self.owner = owner
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return self._get_instance_limiter(instance)
+
+    def _get_instance_limiter(self, instance):
+        limiter = instance.__dict__.get(self.name)
+        if limiter is None:
+            limiter = self.factory(self.func.__get__(instance, type(instance)))
+            instance.__dict__[self.name] = limiter
+        return limiter
+
+    def __call__(self, *args):
+        if self.owner is not None and args and isinstance(args[0], self.owner):
+            self._get_instance_limiter(args[0])(*args[1:])
+            return
+
+        if self.limiter is None:
+            self.limiter = self.factory(self.func)
+        self.limiter(*args)
+
+    def flush(self):
+        """Run the pending call now, if there is one."""
+        if self.limiter is not None:
+            self.limiter.flush()
+
+    def cancel(self):
+        """Drop the pending call, if there is one."""
+        if self.limiter is not None:
+            self.limiter.cancel()
+
+# Decorator to only run a function once calls stop coming for delay ms.
+#
+# With trailing (the default), the last call runs once things settle down,
+# with leading, the first call of a burst runs right away. max_wait (in ms)
+# forces the pending call to run during a long burst. The wrapped function
+# (or, for a method, the bound method of an instance) has flush() and
+# cancel() methods to run or drop the pending call.
+def debounce(delay, leading=False, trailing=True, max_wait=None):
+    def decorator(func):
+        return _RateLimited(func, lambda f: _Debouncer(f, delay, leading, trailing, max_wait))
+    return decorator
+
+# Decorator to run a function at most once every interval ms.
+#
+# With leading (the default), the first call runs right away, with trailing,
+# the last call received during the interval runs at its end.
+def throttle(interval, leading=True, trailing=True):
+    def decorator(func):
+        return _RateLimited(func, lambda f: _Throttler(f, interval, leading, trailing))
+    return decorator
+
+# Decorator to merge calls into a single one, made with the latest arguments
+# from an idle callback.
+def coalesce_idle(func):
+    return _RateLimited(func, _IdleCoalescer)
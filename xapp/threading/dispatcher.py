@@ -0,0 +1,184 @@
+import collections
+import threading
+import time
+import traceback
+
+from gi.repository import GLib
+
+from . import instrumentation
+
+# Default time in ms a dispatcher may spend running callbacks before it lets
+# the main loop handle other events (drawing, input...).
+FRAME_BUDGET = 8
+
+class MainLoopDispatcher(object):
+    """Runs callbacks queued from any thread in the main loop, using a shared
+    idle source at the given priority instead of one per callback. Each time
+    the source runs, queued callbacks are run until the queue is empty or the
+    budget (in ms) is spent, the rest is deferred to the next main loop
+    iteration.
+
+    A callback queued with a key replaces the pending callback with the same
+    key, if any: only the latest one runs, at the position of the first one.
+    As with GLib.idle_add(), a callback returning True is queued again.
+
+    A callback queued with a Gio.Cancellable is dropped if it is cancelled by
+    the time the callback would run."""
+
+    def __init__(self, priority=GLib.PRIORITY_DEFAULT_IDLE, budget=None):
+        self.priority = priority
+        self.budget = FRAME_BUDGET if budget is None else budget
+        self.lock = threading.Lock()
+        self.queue = collections.deque()
+        self.keyed_calls = {}
+        self.source_id = 0
+
+        self.n_queued = 0
+        self.n_coalesced = 0
+        self.n_executed = 0
+        self.n_deferred = 0
+        self.n_dropped = 0
+
+    def queue_call(self, func, args=(), key=None, cancellable=None):
+        with self.lock:
+            self.n_queued += 1
+            if key is None:
+                self.queue.append((None, func, args, cancellable))
+            else:
+                if key in self.keyed_calls:
+                    self.n_coalesced += 1
+                else:
+                    self.queue.append((key, None, None, None))
+                self.keyed_calls[key] = (func, args, cancellable)
+
+            if self.source_id == 0:
+                self._add_source()
+
+    def set_budget(self, budget):
+        self.budget = budget
+
+    def get_n_pending(self):
+        return len(self.queue)
+
+    def get_stats(self):
+        """Return the number of callbacks queued, replaced by a later call with
+        the same key, executed, dropped because they were cancelled, and
+        deferred to a later main loop iteration because the budget was spent
+        (a callback can be deferred more than once), and the number currently
+        pending."""
+        with self.lock:
+            return {
+                "queued": self.n_queued,
+                "coalesced": self.n_coalesced,
+                "executed": self.n_executed,
+                "deferred": self.n_deferred,
+                "dropped": self.n_dropped,
+                "pending": len(self.queue),
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.n_queued = self.n_coalesced = self.n_executed = self.n_deferred = 0
+            self.n_dropped = 0
+
+    def _dispatch(self):
+        with self.lock:
+            # This source is running, it stops once done
+            self.source_id = 0
+
+        deadline = time.monotonic() + self.budget / 1000.0
+        # Callbacks returning True run again, but not before the next main
+        # loop iteration, like with GLib.idle_add()
+        again_calls = []
+
+        while True:
+            with self.lock:
+                if not self.queue:
+                    break
+                key, func, args, cancellable = self.queue.popleft()
+                if key is not None:
+                    func, args, cancellable = self.keyed_calls.pop(key)
+                if cancellable is not None and cancellable.is_cancelled():
+                    self.n_dropped += 1
+                    continue
+                self.n_executed += 1
+
+                # GLib doesn't run a source again while it is dispatching, so
+                # keep another one ready for the rest of the queue in case func
+                # runs a nested main loop (Gtk.Dialog.run()...)
+                if self.queue and self.source_id == 0:
+                    self._add_source()
+
+            timed = instrumentation.enabled
+            if timed:
+                start = time.monotonic()
+
+            try:
+                again = func(*args)
+            except Exception:
+                traceback.print_exc()
+                again = False
+
+            if timed:
+                instrumentation.record(instrumentation.KIND_IDLE, func, time.monotonic() - start)
+
+            if again:
+                again_calls.append((key, func, args, cancellable))
+
+            if time.monotonic() >= deadline:
+                with self.lock:
+                    self.n_deferred += len(self.queue)
+                break
+
+        with self.lock:
+            for key, func, args, cancellable in again_calls:
+                self.n_queued += 1
+                if key is None:
+                    self.queue.append((None, func, args, cancellable))
+                elif key not in self.keyed_calls:
+                    # Unless a newer call with the same key was queued meanwhile
+                    self.queue.append((key, None, None, None))
+                    self.keyed_calls[key] = (func, args, cancellable)
+
+            if self.queue and self.source_id == 0:
+                self._add_source()
+
+        return False
+
+    def _add_source(self):
+        # Called with the lock held
+        self.source_id = GLib.idle_add(self._dispatch, priority=self.priority)
+
+_dispatchers = {}
+_dispatchers_lock = threading.Lock()
+
+def get_dispatcher(priority=GLib.PRIORITY_DEFAULT_IDLE):
+    """Return the dispatcher running callbacks at the given priority, usually
+    one of GLib.PRIORITY_HIGH_IDLE, GLib.PRIORITY_DEFAULT_IDLE,
+    GLib.PRIORITY_DEFAULT or GLib.PRIORITY_LOW."""
+    with _dispatchers_lock:
+        try:
+            return _dispatchers[priority]
+        except KeyError:
+            dispatcher = _dispatchers[priority] = MainLoopDispatcher(priority)
+            return dispatcher
+
+def set_frame_budget(budget, priority=None):
+    """Set the time in ms callbacks may run per main loop iteration, for the
+    dispatcher of the given priority or for all of them."""
+    global FRAME_BUDGET
+
+    if priority is not None:
+        get_dispatcher(priority).set_budget(budget)
+        return
+
+    FRAME_BUDGET = budget
+    with _dispatchers_lock:
+        for dispatcher in _dispatchers.values():
+            dispatcher.set_budget(budget)
+
+def get_idle_stats():
+    """Return the statistics of each dispatcher, by priority."""
+    with _dispatchers_lock:
+        dispatchers = list(_dispatchers.values())
+    return {dispatcher.priority: dispatcher.get_stats() for dispatcher in dispatchers}
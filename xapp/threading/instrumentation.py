@@ -0,0 +1,139 @@
+import atexit
+import os
+import sys
+import threading
+
+# Instrumentation of the work done by run_idle() callbacks (in the main loop)
+# and run_async() functions (in pool threads). It is off by default, turn it
+# on with enable_instrumentation() or by setting XAPP_THREADING_DEBUG=1 in
+# the environment, which also prints a report at exit. The slow callback
+# threshold can be set with XAPP_THREADING_SLOW_MS.
+
+# Main loop callbacks running longer than this (in ms) print a warning
+SLOW_CALLBACK_THRESHOLD = 50
+
+# Upper bounds (in ms) of the histogram buckets, the last bucket is open
+HISTOGRAM_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+
+KIND_IDLE = "idle"
+KIND_ASYNC = "async"
+
+enabled = False
+
+_lock = threading.Lock()
+_timings = {KIND_IDLE: {}, KIND_ASYNC: {}}
+
+class CallbackTimings(object):
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * (len(HISTOGRAM_BUCKETS) + 1)
+
+    def add(self, ms):
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if ms <= bound:
+                self.histogram[i] += 1
+                return
+        self.histogram[-1] += 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total,
+            "mean_ms": self.total / self.count if self.count else 0.0,
+            "max_ms": self.max,
+            "histogram": list(self.histogram),
+        }
+
+def _get_name(func):
+    return "%s.%s" % (getattr(func, "__module__", "?"), getattr(func, "__qualname__", repr(func)))
+
+def record(kind, func, duration):
+    """Record that func took duration seconds, kind being KIND_IDLE for main
+    loop callbacks or KIND_ASYNC for background work."""
+    ms = duration * 1000
+    name = _get_name(func)
+
+    with _lock:
+        timings = _timings[kind].get(name)
+        if timings is None:
+            timings = _timings[kind][name] = CallbackTimings()
+        timings.add(ms)
+
+    if kind == KIND_IDLE and ms >= SLOW_CALLBACK_THRESHOLD:
+        print("xapp.threading: main loop callback %s took %.1f ms" % (name, ms), file=sys.stderr)
+
+def enable_instrumentation(slow_threshold=None):
+    global enabled, SLOW_CALLBACK_THRESHOLD
+
+    if slow_threshold is not None:
+        SLOW_CALLBACK_THRESHOLD = slow_threshold
+    enabled = True
+
+def disable_instrumentation():
+    global enabled
+
+    enabled = False
+
+def reset_instrumentation():
+    with _lock:
+        for timings in _timings.values():
+            timings.clear()
+
+def get_gauges():
+    """Return the current number of threads, of calls waiting in each thread
+    pool and of callbacks pending in each main loop dispatcher."""
+    from .dispatcher import _dispatchers, _dispatchers_lock
+    from .pool import _pools, _pools_lock
+
+    with _pools_lock:
+        pools = {name: {"threads": pool.get_n_threads(), "queued": pool.get_n_queued()}
+                 for name, pool in _pools.items()}
+    with _dispatchers_lock:
+        dispatchers = {priority: dispatcher.get_n_pending()
+                       for priority, dispatcher in _dispatchers.items()}
+
+    return {
+        "threads": threading.active_count(),
+        "pools": pools,
+        "pending_idle": dispatchers,
+    }
+
+def get_instrumentation_report():
+    with _lock:
+        report = {kind: {name: timings.to_dict() for name, timings in by_name.items()}
+                  for kind, by_name in _timings.items()}
+    report["gauges"] = get_gauges()
+    return report
+
+def dump_instrumentation(file=None):
+    """Print the gauges and the timings of each callback, slowest first."""
+    if file is None:
+        file = sys.stderr
+
+    report = get_instrumentation_report()
+    gauges = report["gauges"]
+
+    print("xapp.threading: %d threads" % gauges["threads"], file=file)
+    for name, pool in sorted(gauges["pools"].items()):
+        print("  pool %s: %d threads, %d queued" % (name, pool["threads"], pool["queued"]), file=file)
+    for priority, pending in sorted(gauges["pending_idle"].items()):
+        print("  idle priority %d: %d pending" % (priority, pending), file=file)
+
+    for kind in (KIND_IDLE, KIND_ASYNC):
+        timings = sorted(report[kind].items(), key=lambda item: item[1]["max_ms"], reverse=True)
+        if not timings:
+            continue
+        print("xapp.threading: %s callbacks (count, mean ms, max ms, histogram)" % kind, file=file)
+        for name, t in timings:
+            print("  %s: %d, %.2f, %.2f, %s" % (name, t["count"], t["mean_ms"], t["max_ms"], t["histogram"]),
+                  file=file)
+
+if os.environ.get("XAPP_THREADING_DEBUG"):
+    threshold = os.environ.get("XAPP_THREADING_SLOW_MS")
+    enable_instrumentation(float(threshold) if threshold else None)
+    atexit.register(dump_instrumentation)
@@ -0,0 +1,222 @@
+import concurrent.futures
+import functools
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from gi.repository import GLib
+
+from . import instrumentation
+from .dispatcher import get_dispatcher
+
+DEFAULT_POOL = "default"
+
+class Future(concurrent.futures.Future):
+    """Handle to a function submitted to a ThreadPool. It is a regular
+    concurrent.futures.Future, and also has the join() method of the
+    threading.Thread objects run_async() used to return."""
+
+    def __init__(self):
+        super(Future, self).__init__()
+        self._error_handled = False
+
+    def join(self, timeout=None):
+        concurrent.futures.wait([self], timeout)
+
+    def connect_result(self, on_result=None, on_error=None, on_cancelled=None):
+        """Call on_result(result) from the main loop once the function returns,
+        on_error(exception) if it raised, or on_cancelled() if the Future was
+        cancelled before it ran. Exceptions given to on_error are not printed.
+        Returns the Future, so it can be used directly on the result of a
+        run_async() function."""
+        if on_error is not None:
+            self._error_handled = True
+
+        def on_done(future):
+            if future.cancelled():
+                callback, args = on_cancelled, ()
+            elif future.exception() is not None:
+                callback, args = on_error, (future.exception(),)
+            else:
+                callback, args = on_result, (future.result(),)
+
+            if callback is not None:
+                get_dispatcher().queue_call(_wrap_callback(callback), args)
+
+        self.add_done_callback(on_done)
+        return self
+
+def _wrap_callback(callback):
+    # Named after callback in the instrumentation, and run only once whatever
+    # it returns
+    @functools.wraps(callback)
+    def call(*args):
+        callback(*args)
+        return False
+    return call
+
+class ThreadPool(object):
+    """A pool of up to max_workers daemon threads. Worker threads are only
+    started when there is no idle one to pick up new work. If max_queue is
+    greater than 0, submit() blocks while that many calls are waiting."""
+
+    def __init__(self, name, max_workers=None, max_queue=0):
+        if max_workers is None:
+            max_workers = min(32, (os.cpu_count() or 1) + 4)
+
+        self.name = name
+        self.max_workers = max_workers
+        self.queue = queue.Queue(max_queue)
+        self.threads = []
+        self.idle_semaphore = threading.Semaphore(0)
+        self.lock = threading.Lock()
+
+    def set_max_queue(self, max_queue):
+        # A blocked Queue.put() keeps waiting if maxsize drops to 0, so no
+        # limit is a limit that can't be reached.
+        if max_queue <= 0:
+            max_queue = sys.maxsize
+
+        with self.queue.mutex:
+            self.queue.maxsize = max_queue
+            # Wake up submit() calls blocked by the previous limit
+            self.queue.not_full.notify_all()
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._adjust_workers()
+        self.queue.put((future, func, args, kwargs))
+        return future
+
+    def _submit_internal(self, func):
+        # Run func() without a Future, for the pool's own helpers
+        self._adjust_workers()
+        self.queue.put((None, func, (), {}))
+
+    def get_n_threads(self):
+        return len(self.threads)
+
+    def get_n_queued(self):
+        return self.queue.qsize()
+
+    def _adjust_workers(self):
+        if self.idle_semaphore.acquire(timeout=0):
+            return
+
+        with self.lock:
+            if len(self.threads) < self.max_workers:
+                thread = threading.Thread(target=self._worker,
+                                          name="%s-%d" % (self.name, len(self.threads)))
+                thread.daemon = True
+                thread.start()
+                self.threads.append(thread)
+
+    def _worker(self):
+        while True:
+            future, func, args, kwargs = self.queue.get()
+            if future is None:
+                func()
+            else:
+                _run(future, func, args, kwargs)
+            self.idle_semaphore.release()
+
+def _run(future, func, args, kwargs):
+    if not future.set_running_or_notify_cancel():
+        return
+
+    timed = instrumentation.enabled
+    if timed:
+        start = time.monotonic()
+
+    try:
+        result = func(*args, **kwargs)
+    except BaseException as e:
+        future.set_exception(e)
+        _print_unhandled_exception(future, func, e)
+    else:
+        future.set_result(result)
+
+    if timed:
+        instrumentation.record(instrumentation.KIND_ASYNC, func, time.monotonic() - start)
+
+def _is_main_loop_running():
+    # A running main loop owns the default context
+    context = GLib.MainContext.default()
+    if context.is_owner():
+        return GLib.main_depth() > 0
+    if context.acquire():
+        context.release()
+        return False
+    return True
+
+def _print_unhandled_exception(future, func, e):
+    # Don't let errors vanish, threads used to print them too. Checked from
+    # the main loop, as on_error may only be connected once the function
+    # already failed. Without a main loop, on_error couldn't run anyway and
+    # the check would never happen, so print it right away.
+    def print_exception():
+        if not future._error_handled:
+            print("Exception in %s:" % getattr(func, "__qualname__", func), file=sys.stderr)
+            traceback.print_exception(type(e), e, e.__traceback__)
+        return False
+
+    if _is_main_loop_running():
+        get_dispatcher().queue_call(print_exception)
+    else:
+        print_exception()
+
+def wrap_future(source, func=None):
+    """Return a Future following the state of the concurrent.futures.Future
+    source, so that connect_result() can be used with it. Cancelling the
+    returned Future cancels source. func is only used to name the function
+    if an unhandled exception is printed."""
+    future = Future()
+
+    def on_source_done(source):
+        if source.cancelled():
+            future.cancel()
+            return
+
+        e = source.exception()
+        if future.done():
+            return
+        if e is not None:
+            future.set_exception(e)
+            _print_unhandled_exception(future, func, e)
+        else:
+            future.set_result(source.result())
+
+    def on_future_done(future):
+        if future.cancelled():
+            source.cancel()
+
+    future.add_done_callback(on_future_done)
+    source.add_done_callback(on_source_done)
+    return future
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(name=DEFAULT_POOL):
+    """Return the ThreadPool called name, creating it with the default
+    settings if needed."""
+    with _pools_lock:
+        try:
+            return _pools[name]
+        except KeyError:
+            pool = _pools[name] = ThreadPool(name)
+            return pool
+
+def configure_pool(name=DEFAULT_POOL, max_workers=None, max_queue=None):
+    """Set the size limits of the pool called name, limits given as None are
+    left unchanged. Apps can give each kind of work its own pool, so that e.g.
+    slow network lookups can't starve icon loading."""
+    pool = get_pool(name)
+    if max_workers is not None:
+        pool.max_workers = max_workers
+    if max_queue is not None:
+        pool.set_max_queue(max_queue)
+    return pool
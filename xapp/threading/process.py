@@ -0,0 +1,83 @@
+import concurrent.futures
+import functools
+import importlib
+import multiprocessing
+import pickle
+import threading
+
+from concurrent.futures.process import BrokenProcessPool
+
+from .pool import wrap_future
+
+_executor = None
+_executor_lock = threading.Lock()
+_max_workers = None
+
+def _call_pickled(data):
+    module_name, qualname, args, kwargs = pickle.loads(data)
+
+    func = importlib.import_module(module_name)
+    for name in qualname.split("."):
+        func = getattr(func, name)
+    # Call the original function, not the run_in_process() wrapper
+    func = getattr(func, "__wrapped__", func)
+
+    return func(*args, **kwargs)
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            # Forking a process which runs a Gtk main loop isn't safe, new
+            # workers are forked from a clean server process instead.
+            context = multiprocessing.get_context("forkserver")
+            _executor = concurrent.futures.ProcessPoolExecutor(_max_workers, mp_context=context)
+        return _executor
+
+def configure_process_pool(max_workers=None):
+    """Set the number of worker processes (the number of CPUs by default).
+    The running pool, if any, is shut down once its pending work is done."""
+    global _executor, _max_workers
+
+    with _executor_lock:
+        _max_workers = max_workers
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+            _executor = None
+
+def submit_to_process(func, *args, **kwargs):
+    """Run func(*args, **kwargs) in the process pool and return a Future.
+
+    func must be defined at the top level of a module, and the arguments and
+    return value must be picklable. Arguments are pickled right away, so an
+    unpicklable argument raises TypeError here rather than in the pool."""
+    qualname = func.__qualname__
+    if "<locals>" in qualname or "<lambda>" in qualname:
+        raise TypeError("%s can't be run in another process, it isn't defined at module level" % qualname)
+
+    try:
+        data = pickle.dumps((func.__module__, qualname, args, kwargs), pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError, TypeError, AttributeError) as e:
+        raise TypeError("arguments of %s can't be sent to another process: %s" % (qualname, e))
+
+    try:
+        future = _get_executor().submit(_call_pickled, data)
+    except BrokenProcessPool:
+        # A worker died, start over with a new pool
+        configure_process_pool(_max_workers)
+        future = _get_executor().submit(_call_pickled, data)
+
+    return wrap_future(future, func)
+
+# Decorator to run CPU bound things in another process
+#
+# Like run_async(), but the function runs in a pool of worker processes, so
+# it isn't limited by the GIL. Calls return a Future, use its
+# connect_result() method to get the result back in the main loop. See
+# submit_to_process() for the restrictions on the function and arguments.
+def run_in_process(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return submit_to_process(func, *args, **kwargs)
+    return wrapper
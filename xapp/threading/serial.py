@@ -0,0 +1,62 @@
+import collections
+import threading
+import weakref
+
+from .pool import DEFAULT_POOL, Future, _run, get_pool
+
+class SerialQueue(object):
+    """Runs the functions submitted to it one at a time, in submission order,
+    in a thread of the given pool. Different queues run in parallel, so work
+    touching the same resource (a file, a settings key...) can be ordered
+    without a global lock."""
+
+    def __init__(self, name, pool=DEFAULT_POOL):
+        self.name = name
+        self.pool = pool
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.running = False
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+
+        with self.lock:
+            self.pending.append((future, func, args, kwargs))
+            if self.running:
+                return future
+            self.running = True
+
+        get_pool(self.pool)._submit_internal(self._drain)
+        return future
+
+    def get_n_pending(self):
+        return len(self.pending)
+
+    def _drain(self):
+        # Runs everything queued, including work submitted meanwhile, in the
+        # same pool thread.
+        while True:
+            with self.lock:
+                if not self.pending:
+                    self.running = False
+                    return
+                future, func, args, kwargs = self.pending.popleft()
+
+            _run(future, func, args, kwargs)
+
+# Queues only live while they have work or someone holds them, so that
+# per-file or per-key names don't pile up. Work keeps its queue alive, so
+# calls are still ordered against earlier ones which didn't finish.
+_queues = weakref.WeakValueDictionary()
+_queues_lock = threading.Lock()
+
+def get_serial_queue(name, pool=DEFAULT_POOL):
+    """Return the SerialQueue called name, creating it if needed. Raises
+    ValueError if the queue exists and uses another pool."""
+    with _queues_lock:
+        queue = _queues.get(name)
+        if queue is None:
+            queue = _queues[name] = SerialQueue(name, pool)
+        elif queue.pool != pool:
+            raise ValueError("serial queue %r uses pool %r, not %r" % (name, queue.pool, pool))
+        return queue
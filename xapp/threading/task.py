@@ -0,0 +1,115 @@
+import threading
+import traceback
+
+from gi.repository import Gio
+
+from .dispatcher import get_dispatcher
+from .pool import DEFAULT_POOL, get_pool
+
+class TaskCancelledError(Exception):
+    """Raised by Task.check_cancelled() to stop a cancelled task."""
+    pass
+
+_current = threading.local()
+
+def get_current_task():
+    """Return the Task running in the calling thread, or None."""
+    return getattr(_current, "task", None)
+
+class Task(object):
+    """Background work which can be cancelled.
+
+    The task carries a Gio.Cancellable, which is cancelled by cancel() or
+    when the widget the task is associated with is destroyed. The worker
+    function should check it regularly with check_cancelled() (raising
+    TaskCancelledError, which ends the task quietly) or is_cancelled(), and
+    can pass task.cancellable to Gio calls. Use get_current_task() to reach
+    the task from the worker.
+
+    run_idle() callbacks queued from the task's worker are dropped if the
+    task is cancelled before they run, so they never touch a destroyed
+    widget."""
+
+    def __init__(self, func, args=(), kwargs=None, widget=None, cancellable=None, pool=DEFAULT_POOL):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs if kwargs is not None else {}
+        self.pool = pool
+        self.cancellable = cancellable if cancellable is not None else Gio.Cancellable()
+        self.future = None
+
+        self.widget = widget
+        self.destroy_id = 0
+        if widget is not None:
+            self.destroy_id = widget.connect("destroy", self._on_widget_destroyed)
+
+    def start(self):
+        if self.future is None:
+            self.future = get_pool(self.pool).submit(self._run)
+            self.future.add_done_callback(self._on_done)
+        return self
+
+    def cancel(self):
+        self.cancellable.cancel()
+        if self.future is not None:
+            self.future.cancel()
+
+    def is_cancelled(self):
+        return self.cancellable.is_cancelled()
+
+    def check_cancelled(self):
+        if self.cancellable.is_cancelled():
+            raise TaskCancelledError()
+
+    def connect_result(self, on_result=None, on_error=None, on_cancelled=None):
+        """Like Future.connect_result(), except that a task which was cancelled
+        while running gets on_cancelled() called instead of on_result()."""
+        def result_cb(result):
+            if self.is_cancelled():
+                if on_cancelled is not None:
+                    on_cancelled()
+            elif on_result is not None:
+                on_result(result)
+
+        def error_cb(e):
+            if self.is_cancelled():
+                if on_cancelled is not None:
+                    on_cancelled()
+            elif on_error is not None:
+                on_error(e)
+            else:
+                traceback.print_exception(type(e), e, e.__traceback__)
+
+        self.start()
+        self.future.connect_result(result_cb, error_cb, on_cancelled)
+        return self
+
+    def _run(self):
+        _current.task = self
+        try:
+            return self.func(*self.args, **self.kwargs)
+        except TaskCancelledError:
+            return None
+        finally:
+            _current.task = None
+
+    def _on_widget_destroyed(self, widget):
+        self.destroy_id = 0
+        self.widget = None
+        self.cancel()
+
+    def _on_done(self, future):
+        # Runs in the worker thread, disconnect from the main loop
+        get_dispatcher().queue_call(self._disconnect_widget)
+
+    def _disconnect_widget(self):
+        if self.destroy_id > 0:
+            self.widget.disconnect(self.destroy_id)
+            self.destroy_id = 0
+        self.widget = None
+        return False
+
+def run_task(func, *args, widget=None, cancellable=None, **kwargs):
+    """Start func(*args, **kwargs) as a Task in the default pool and return
+    the task."""
+    return Task(func, args, kwargs, widget=widget, cancellable=cancellable).start()